@@ -36,8 +36,10 @@ class BackupState(object):
             self.prefix + hashlib.sha256(encodeutf8(remotepath)).hexdigest()[0:8],
         )
         self.heads = set()
-        if repo.sharedvfs.exists(self.filename) and not resetlocalstate:
-            lines = repo.sharedvfs.readutf8(self.filename).splitlines()
+        # A missing file reads as empty, so there is no need to stat it first.
+        data = "" if resetlocalstate else repo.sharedvfs.tryreadutf8(self.filename)
+        if data:
+            lines = data.splitlines()
             if len(lines) < 2 or lines[0].strip() != FORMAT_VERSION:
                 version = lines[0].strip() if len(lines) > 0 else "<empty>"
                 repo.ui.debug(
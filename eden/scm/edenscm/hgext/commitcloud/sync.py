@@ -5,7 +5,6 @@
 
 from __future__ import absolute_import
 
-import itertools
 import re
 import socket
 import time
@@ -59,22 +58,27 @@ def _isremotebookmarkssyncenabled(ui):
 
 
 def _getheads(repo):
+    # Resolve nodes straight from revsets, rather than building a changectx
+    # for every head.
+    tohex = nodemod.hex
     if visibility.enabled(repo):
         # Visible heads can contain public heads in some cases due to a known issue.
         # TODO (liubovd): remove the filer once the issue is fixed.
-        return [nodemod.hex(n) for n in visibility.heads(repo) if repo[n].mutable()]
+        heads = repo.nodes("%ln - public()", visibility.heads(repo))
     else:
         # Select the commits to sync.  To match previous behaviour, this is
         # all draft but not obsolete commits, plus any bookmarked commits,
         # and all of their ancestors.
-        headsrevset = repo.set(
+        heads = repo.nodes(
             "heads(draft() & ::((draft() & not obsolete()) + bookmark()))"
         )
-        return [ctx.hex() for ctx in headsrevset]
+    return [tohex(n) for n in heads]
 
 
 def _getbookmarks(repo):
-    return {n: nodemod.hex(v) for n, v in repo._bookmarks.items()}
+    # Bind locally: this runs per bookmark, and there may be many of them.
+    tohex = nodemod.hex
+    return {n: tohex(v) for n, v in repo._bookmarks.items()}
 
 
 def _getprotectedremotebookmarks(repo):
@@ -789,82 +793,94 @@ def _mergebookmarks(repo, tr, cloudbookmarks, lastsyncstate, omittedheads, maxag
     unfi = repo
     localbookmarks = _getbookmarks(repo)
     omittedbookmarks = set(lastsyncstate.omittedbookmarks)
-    changes = []
-    allnames = set(list(localbookmarks.keys()) + list(cloudbookmarks.keys()))
-    newnames = set()
+    allnames = localbookmarks.keys() | cloudbookmarks.keys()
     mindate = (time.time() - maxage * 86400) if maxage is not None else 0
     oldbookmarks = {}
+    getlocal = localbookmarks.get
+    getcloud = cloudbookmarks.get
+    getlastcloud = lastsyncstate.bookmarks.get
+    # Look up which cloud bookmark commits are available with one query,
+    # rather than checking each one individually in the loop.
+    knowncloudnodes = {
+        nodemod.hex(n)
+        for n in repo.changelog.filternodes(
+            [nodemod.bin(n) for n in set(cloudbookmarks.values())]
+        )
+    }
+
+    # Classify each bookmark in a single pass.  Forks are named afterwards,
+    # once the set of existing names is final.
+    forks = []  # (name, localnode) changed both locally and in the cloud
+    updates = []  # (name, cloudnode) to move to the cloud's commit
+    deletions = []  # names to remove locally
     for name in allnames:
         # We are doing a 3-way diff between the local bookmark and the cloud
         # bookmark, using the previous cloud bookmark's value as the common
         # ancestor.
-        localnode = localbookmarks.get(name)
-        cloudnode = cloudbookmarks.get(name)
-        lastcloudnode = lastsyncstate.bookmarks.get(name)
-        if cloudnode != localnode:
-            # The local and cloud bookmarks differ, so we must merge them.
-
-            # First, check if there is a conflict.
-            if (
-                localnode is not None
-                and cloudnode is not None
-                and localnode != lastcloudnode
-                and cloudnode != lastcloudnode
-            ):
-                # The bookmark has changed both locally and remotely.  Fork the
-                # bookmark by renaming the local one.
-                forkname = _forkname(repo.ui, name, allnames | newnames)
-                newnames.add(forkname)
-                changes.append((forkname, nodemod.bin(localnode)))
+        localnode = getlocal(name)
+        cloudnode = getcloud(name)
+        lastcloudnode = getlastcloud(name)
+        if cloudnode == localnode:
+            continue
+
+        # The local and cloud bookmarks differ, so we must merge them.
+        if localnode != lastcloudnode and cloudnode != lastcloudnode:
+            if localnode is not None and cloudnode is not None:
+                # The bookmark has changed both locally and remotely.  Fork
+                # the bookmark by renaming the local one.
+                forks.append((name, localnode))
+        if cloudnode == lastcloudnode:
+            # Only the local bookmark has changed; it will be sent to the
+            # cloud later.
+            continue
+
+        # The cloud bookmark has changed, so we must apply its changes locally.
+        if cloudnode is None:
+            # The bookmarks has been deleted in the cloud.  If it has also been
+            # moved in the repo at the same time, allow the local bookmark to
+            # persist - this will mean it is resurrected at the new local
+            # location.  Otherwise remove the bookmark locally.
+            if localnode is None or localnode == lastcloudnode:
+                deletions.append(name)
+        elif cloudnode in knowncloudnodes:
+            # The cloud bookmark has been set to point to a new commit.
+            ctx = unfi[cloudnode]
+            # The cloud bookmark is for a public commit but older than the requested age.
+            if localnode is None and not ctx.mutable() and ctx.date()[0] < mindate:
+                oldbookmarks[name] = cloudnode
+                omittedbookmarks.add(name)
+            else:
+                # The commit is available locally, so update the bookmark.
+                updates.append((name, cloudnode))
+                omittedbookmarks.discard(name)
+        else:
+            # The commit is not available locally.  Omit it.
+            if cloudnode not in omittedheads:
                 repo.ui.warn(
-                    _(
-                        "%s changed locally and remotely, "
-                        "local bookmark renamed to %s\n"
-                    )
-                    % (name, forkname)
+                    _("%s not found, omitting %s bookmark\n") % (cloudnode[:12], name)
                 )
+            omittedbookmarks.add(name)
+            if localnode is not None:
+                deletions.append(name)
+
+    # Name the forks.  The loop over allnames is done, so it can be extended
+    # with each new name rather than rebuilding a union per fork.
+    forknames = []
+    for name, localnode in forks:
+        forkname = _forkname(repo.ui, name, allnames)
+        allnames.add(forkname)
+        forknames.append((forkname, localnode))
+        repo.ui.warn(
+            _("%s changed locally and remotely, local bookmark renamed to %s\n")
+            % (name, forkname)
+        )
 
-            # If the cloud bookmarks has changed, we must apply its changes
-            # locally.
-            if cloudnode != lastcloudnode:
-                if cloudnode is not None:
-                    # The cloud bookmark has been set to point to a new commit.
-                    if cloudnode in unfi:
-                        ctx = unfi[cloudnode]
-                        # The cloud bookmark is for a public commit but older than the requested age.
-                        if (
-                            localnode is None
-                            and not ctx.mutable()
-                            and ctx.date()[0] < mindate
-                        ):
-                            oldbookmarks[name] = cloudnode
-                            omittedbookmarks.add(name)
-                        else:
-                            # The commit is available locally, so update the
-                            # bookmark.
-                            changes.append((name, nodemod.bin(cloudnode)))
-                            omittedbookmarks.discard(name)
-                    else:
-                        # The commit is not available locally.  Omit it.
-                        if cloudnode not in omittedheads:
-                            repo.ui.warn(
-                                _("%s not found, omitting %s bookmark\n")
-                                % (cloudnode[:12], name)
-                            )
-                        omittedbookmarks.add(name)
-                        if name in localbookmarks:
-                            changes.append((name, None))
-                else:
-                    # The bookmarks has been deleted in the cloud.
-                    if localnode is not None and localnode != lastcloudnode:
-                        # Although it has been deleted in the cloud, it has
-                        # been moved in the repo at the same time.  Allow the
-                        # local bookmark to persist - this will mean it is
-                        # resurrected at the new local location.
-                        pass
-                    else:
-                        # Remove the bookmark locally.
-                        changes.append((name, None))
+    tobin = nodemod.bin
+    changes = (
+        [(forkname, tobin(localnode)) for forkname, localnode in forknames]
+        + [(name, tobin(cloudnode)) for name, cloudnode in updates]
+        + [(name, None) for name in deletions]
+    )
 
     if oldbookmarks:
         counter = 0
@@ -894,18 +910,52 @@ def _mergebookmarks(repo, tr, cloudbookmarks, lastsyncstate, omittedheads, maxag
 
 def _forkname(ui, name, othernames):
     hostname = ui.config("commitcloud", "hostname", socket.gethostname())
+    return _forknameforhost(name, hostname, othernames)
+
+
+# Compiled fork suffix patterns, keyed by hostname.
+_forksuffixres = {}
+
+
+def _forknameforhost(name, hostname, othernames):
+    """pick a name for a forked bookmark that is not in othernames
+
+    Any existing fork suffix is stripped from name, and the new name is
+    numbered after the highest existing fork of the same bookmark.
+
+    >>> _forknameforhost("book", "host", {"book"})
+    'book-host'
+    >>> _forknameforhost("book", "host", {"book", "book-host"})
+    'book-host-1'
+    >>> _forknameforhost("book-host-1", "host", {"book-host", "book-host-3"})
+    'book-host-4'
+    >>> _forknameforhost("book-host", "host", {"book-host", "other-host-7"})
+    'book-host-1'
+    """
+    suffixre = _forksuffixres.get(hostname)
+    if suffixre is None:
+        suffixre = re.compile("-%s(?:-([0-9]+))?$" % re.escape(hostname))
+        _forksuffixres[hostname] = suffixre
 
     # Strip off any old suffix.
-    m = re.match("-%s(-[0-9]*)?$" % re.escape(hostname), name)
+    m = suffixre.search(name)
     if m:
-        suffix = "-%s%s" % (hostname, m.group(1) or "")
-        name = name[0 : -len(suffix)]
+        name = name[: m.start()]
 
-    # Find a new name.
-    for n in itertools.count():
-        candidate = "%s-%s%s" % (name, hostname, "-%s" % n if n != 0 else "")
-        if candidate not in othernames:
-            return candidate
+    # Find the highest existing fork of this name in a single pass.
+    maxn = None
+    namelen = len(name)
+    for other in othernames:
+        if other.startswith(name):
+            m = suffixre.match(other, namelen)
+            if m:
+                n = int(m.group(1) or 0)
+                if maxn is None or n > maxn:
+                    maxn = n
+
+    if maxn is None:
+        return "%s-%s" % (name, hostname)
+    return "%s-%s-%s" % (name, hostname, maxn + 1)
 
 
 @perftrace.tracefunc("Check Omissions")
@@ -1020,9 +1070,9 @@ def _submitlocalchanges(repo, reponame, workspacename, lastsyncstate, failed, se
     omittedheads = set(lastsyncstate.omittedheads)
     omittedbookmarks = set(lastsyncstate.omittedbookmarks)
     omittedremotebookmarks = set(lastsyncstate.omittedremotebookmarks)
-    localsyncedheads = [
+    localsyncedheads = {
         head for head in lastsyncstate.heads if head not in omittedheads
-    ]
+    }
     localsyncedbookmarks = {
         name: node
         for name, node in lastsyncstate.bookmarks.items()
@@ -1039,8 +1089,9 @@ def _submitlocalchanges(repo, reponame, workspacename, lastsyncstate, failed, se
         and localremotebookmarks != localsyncedremotebookmarks
     )
 
+    localheadsset = set(localheads)
     if (
-        set(localheads) == set(localsyncedheads)
+        localheadsset == localsyncedheads
         and localbookmarks == localsyncedbookmarks
         and not remotebookmarkschanged
         and lastsyncstate.version != 0
@@ -1054,7 +1105,7 @@ def _submitlocalchanges(repo, reponame, workspacename, lastsyncstate, failed, se
     # Work out the new cloud heads and bookmarks by merging in the
     # omitted items.  We need to preserve the ordering of the cloud
     # heads so that smartlogs generally match.
-    localandomittedheads = set(localheads).union(lastsyncstate.omittedheads)
+    localandomittedheads = localheadsset.union(lastsyncstate.omittedheads)
     newcloudheads = util.removeduplicates(
         [head for head in lastsyncstate.heads if head in localandomittedheads]
         + localheads
@@ -1065,7 +1116,7 @@ def _submitlocalchanges(repo, reponame, workspacename, lastsyncstate, failed, se
     }
 
     # Work out what the new omitted heads and bookmarks are.
-    newomittedheads = list(set(newcloudheads).difference(localheads))
+    newomittedheads = [head for head in newcloudheads if head not in localheadsset]
     newomittedbookmarks = list(
         set(newcloudbookmarks.keys()).difference(localbookmarks.keys())
     )
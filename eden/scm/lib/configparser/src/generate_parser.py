@@ -8,6 +8,7 @@
 import hashlib
 import os
 import re
+import shutil
 import subprocess
 import tempfile
 
@@ -16,15 +17,94 @@ dirname = os.path.dirname
 
 crate_root = dirname(dirname(os.path.realpath(__file__)))
 
+# Expanded parsers are cached here, keyed by everything that affects the
+# output of cargo-expand. Only the most recently used entries are kept.
+# The cache is per-user, since its content ends up in the committed parser.rs.
+cache_root = os.path.expanduser("~/.cache/pest-hgrc/expanded")
+cache_max_entries = 16
+
+# Cargo target directory shared by cargo-expand runs.
+target_root = os.path.expanduser("~/.cache/pest-hgrc/target")
+
+# Items to keep from the cargo-expand output. Each item ends at the first
+# unindented "}" after its header.
+rule_struct_re = re.compile(r"^pub enum Rule\b[\s\S]*?^\}", re.M)
+parser_impl_re = re.compile(
+    r"^impl ::pest::Parser<Rule> for ConfigParser\b[\s\S]*?^\}", re.M
+)
+
+
+def read_cargo_toml():
+    """read Cargo.toml, without [dev-dependencies] and [[bench]]"""
+    with open(os.path.join(crate_root, "Cargo.toml")) as f:
+        return f.read().split("[dev-dependencies]")[0]
+
+
+def cache_key(pest, cargo_toml):
+    cargo_expand_version = subprocess.check_output(["cargo-expand", "--version"])
+    # The cached code is produced by this script's template and extraction
+    # regexes, so editing the script must invalidate it too.
+    with open(os.path.realpath(__file__), "rb") as f:
+        generator = f.read()
+    h = hashlib.sha1()
+    for part in (pest, cargo_toml.encode("utf-8"), cargo_expand_version, generator):
+        h.update(b"%d\0" % len(part))
+        h.update(part)
+    return h.hexdigest()
+
+
+def evict_cache():
+    """remove the least recently used cache entries"""
+    entries = []
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        try:
+            mtime = os.path.getmtime(os.path.join(path, "parser.rs.fragment"))
+        except OSError:
+            mtime = 0
+        entries.append((mtime, path))
+    entries.sort(reverse=True)
+    for _mtime, path in entries[cache_max_entries:]:
+        shutil.rmtree(path, ignore_errors=True)
+
 
 def expand_parser(pest):
-    """expand the "#[derive(Parser)] part"""
+    """expand the "#[derive(Parser)] part", reusing a cached result if any"""
+    cargo_toml = read_cargo_toml()
+    cache_dir = os.path.join(cache_root, cache_key(pest, cargo_toml))
+    cache_path = os.path.join(cache_dir, "parser.rs.fragment")
+
+    try:
+        with open(cache_path) as f:
+            code = f.read()
+        # Bump mtime so the entry is treated as recently used.
+        os.utime(cache_path)
+        return code
+    except OSError:
+        pass
+
+    code = run_cargo_expand(pest, cargo_toml)
+
+    # Write atomically so concurrent runs never observe a partial file.
+    # Caching is best-effort: failing to write it is not an error.
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write(code)
+        os.replace(tmp_path, cache_path)
+        evict_cache()
+    except OSError as e:
+        print("Cannot update cache at %s: %s" % (cache_dir, e))
+
+    return code
+
+
+def run_cargo_expand(pest, cargo_toml):
+    """expand the "#[derive(Parser)] part" by running cargo-expand"""
     with tempfile.TemporaryDirectory() as tmp_root:
-        # Copy Cargo.toml, without [dev-dependencies] and [[bench]]
         with open(os.path.join(tmp_root, "Cargo.toml"), "w") as f:
-            content = open(os.path.join(crate_root, "Cargo.toml")).read()
-            content = content.split("[dev-dependencies]")[0]
-            f.write(content)
+            f.write(cargo_toml)
 
         # Copy spec.pest
         os.mkdir(os.path.join(tmp_root, "src"))
@@ -41,21 +121,20 @@ pub(crate) struct ConfigParser;
 """
             )
 
-        # Run cargo-expand
+        # Run cargo-expand. Share the target directory across runs so
+        # dependencies like pest_derive and syn are only compiled once.
+        os.makedirs(target_root, exist_ok=True)
         env = os.environ.copy()
         env["RUSTFMT"] = "false"
+        env["CARGO_TARGET_DIR"] = target_root
         expanded = subprocess.check_output(
             ["cargo-expand", "--release"], env=env, cwd=tmp_root
         )
         expanded = expanded.decode("utf-8")
 
         # Keep only interesting parts
-        rule_struct = re.search("^pub enum Rule [^}]*^\}", expanded, re.S + re.M).group(
-            0
-        )
-        parser_impl = re.search(
-            "^impl ::pest::Parser<Rule> for ConfigParser .*^\}", expanded, re.S + re.M
-        ).group(0)
+        rule_struct = rule_struct_re.search(expanded).group(0)
+        parser_impl = parser_impl_re.search(expanded).group(0)
 
         code = f"""
 #[allow(dead_code, non_camel_case_types)]
@@ -70,17 +149,28 @@ pub(crate) struct ConfigParser;
         return code
 
 
+def file_sha1(path):
+    """sha1 of a file, without reading it into memory at once"""
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        h = hashlib.sha1()
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+        return h.hexdigest()
+
+
 def write_generated_parser():
     spec_pest_path = os.path.join(crate_root, "src", "spec.pest")
-    with open(spec_pest_path, "rb") as f:
-        spec = f.read()
-
-    checksum = hashlib.sha1(spec).hexdigest()
+    checksum = file_sha1(spec_pest_path)
     output_path = os.path.join(crate_root, "src", "parser.rs")
 
     try:
+        # The checksum is in the header comment. No need to read the whole file.
         with open(output_path) as f:
-            old_checksum = re.search(r"pest-checksum: (.*)\.", f.read()).group(1)
+            head = f.read(2048)
+        _, _, rest = head.partition("pest-checksum: ")
+        old_checksum = rest.partition(".")[0]
         if old_checksum == checksum:
             print(
                 "No need to update %s because %s is not changed."
@@ -90,6 +180,9 @@ def write_generated_parser():
     except Exception:
         pass
 
+    with open(spec_pest_path, "rb") as f:
+        spec = f.read()
+
     with open(output_path, "w") as f:
         code = expand_parser(spec)
         f.write(
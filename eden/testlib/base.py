@@ -21,6 +21,9 @@ class BaseTest(unittest.TestCase):
     def setUp(self) -> None:
         test_globals.setup()
         self.addCleanup(test_globals.cleanup)
+        # In-process hg commands leave the cwd wherever they last ran. Step
+        # back out before the cleanups above remove the test directories.
+        self.addCleanup(os.chdir, os.getcwd())
         self.server = self.new_server()
         self.addCleanup(self.server.cleanup)
         self.config = Config(Path(test_globals.env["HGRCPATH"]))
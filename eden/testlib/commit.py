@@ -32,21 +32,28 @@ class Commit:
         return super().__eq__(other)
 
     def ancestor(self, idx: int) -> Commit:
-        commit = self
-        # This could be more efficient, instead of execing hg for every step of
-        # the parent.
-        while idx > 0:
-            idx -= 1
-            parents = self.parents()
-            if len(parents) == 0:
-                raise ValueError("reached end of history when traversing parents")
-            commit = parents[0]
-        return commit
+        if idx <= 0:
+            return self
+        # "x~n" follows first parents only, in a single hg invocation.
+        raw = self.repo.hg.log(
+            rev=f"{self.hash}~{idx}", template="{node}\n", binary_output=True
+        ).stdout
+        lines = raw.split(b"\n")
+        if len(lines) < 2:
+            raise ValueError("reached end of history when traversing parents")
+        return Commit(self.repo, lines[0].decode("ascii"))
 
     def status(self) -> Status:
-        return Status(self.repo.hg.status(change=self.hash, template="json").stdout)
+        # json.loads accepts bytes, so skip decoding the output to str.
+        return Status(
+            self.repo.hg.status(
+                change=self.hash, template="json", binary_output=True
+            ).stdout
+        )
 
     def parents(self) -> List[Commit]:
-        raw = self.repo.hg.log(rev=f"parents({self.hash})", template="{node}\n").stdout
-        lines = raw.split("\n")
-        return [Commit(self.repo, hash) for hash in lines[:-1]]
+        raw = self.repo.hg.log(
+            rev=f"parents({self.hash})", template="{node}\n", binary_output=True
+        ).stdout
+        lines = raw.split(b"\n")
+        return [Commit(self.repo, hash.decode("ascii")) for hash in lines[:-1]]
@@ -8,16 +8,21 @@ from __future__ import annotations
 import io
 import os
 import subprocess
+import threading
+from itertools import chain
 from pathlib import Path
 from subprocess import CompletedProcess
-from typing import Dict, List
+from typing import Dict, List, Union
 
 import bindings
 
-from .util import override_environ, test_globals, trace
+from .util import override_environ, test_globals, trace, tracing
 
 hg_bin = Path(os.environ["HGTEST_HG"])
 
+# In-process commands share the process-wide cwd and environment.
+_inproc_lock = threading.Lock()
+
 
 class CliCmd:
     cwd: Path
@@ -27,6 +32,10 @@ class CliCmd:
     def __init__(self, cwd: Path, env: Dict[str, str]) -> None:
         self.cwd = cwd
         self.env = env
+        # Output buffers reused by every in-process command. They are only
+        # touched while holding _inproc_lock.
+        self._fout = io.BytesIO()
+        self._ferr = io.BytesIO()
 
     def __getattr__(self, command: str):
         """
@@ -52,62 +61,72 @@ class CliCmd:
         future we can make this invoke the commands inside the test process.
         """
 
-        def func(*args: str, **kwargs: str):
-            input = kwargs.pop("stdin", "").encode("utf8")
-            binary = kwargs.get("binary_output", False)
-
-            cmd_args = [str(a) for a in args]
-            for key, value in kwargs.items():
-                key = key.replace("_", "-")
-                prefix = "--" if len(key) != 1 else "-"
-                option = "%s%s" % (prefix, key)
-                if isinstance(value, bool):
-                    if value:
-                        cmd_args.append(option)
-                elif isinstance(value, str):
-                    cmd_args.extend([option, value])
-                else:
+        def func(
+            *args: str,
+            stdin: str = "",
+            binary_output: bool = False,
+            **kwargs: Union[str, bool],
+        ):
+            input = stdin.encode("utf8")
+
+            flags = [_option(key) for key, value in kwargs.items() if value is True]
+            pairs = [
+                (_option(key), value)
+                for key, value in kwargs.items()
+                if not isinstance(value, bool)
+            ]
+            for _option_name, value in pairs:
+                if not isinstance(value, str):
                     raise ValueError(
                         "clicmd does not support type %s ('%s')" % (type(value), value)
                     )
+            cmd_args = [str(a) for a in args] + flags + list(chain.from_iterable(pairs))
 
-            env = os.environ.copy()
-            env.update(self.env)
-
-            trace_output = f"$ hg {command}"
-            for arg in cmd_args:
-                if " " in arg:
-                    arg = f'"{arg}"'
-                trace_output += f" {arg}"
-            trace(trace_output)
+            if tracing:
+                trace(
+                    " ".join(
+                        [f"$ hg {command}"]
+                        + [f'"{arg}"' if " " in arg else arg for arg in cmd_args]
+                    )
+                )
 
             if os.environ.get("HGTEST_SHELLOUT", False):
+                env = os.environ.copy()
+                env.update(self.env)
                 result = self._shellout(command, cmd_args, env, input)
             else:
-                result = self._inproc(command, cmd_args, env, input)
+                # os.environ is inherited in-process, so only the overrides
+                # need to be applied.
+                result = self._inproc(command, cmd_args, self.env, input)
 
-            if not binary:
+            if not binary_output:
                 result.stdout = result.stdout.decode("utf8", errors="replace")
                 result.stderr = result.stderr.decode("utf8", errors="replace")
 
-            if result.stdout:
-                trace(result.stdout)
-            if result.stderr:
-                trace(result.stderr)
-            if not result.stdout and not result.stderr:
-                trace("(no output)")
+            if tracing:
+                output = [
+                    s if isinstance(s, str) else s.decode("utf8", errors="replace")
+                    for s in (result.stdout, result.stderr)
+                    if s
+                ]
+                if not output:
+                    output.append("(no output)")
+                if result.returncode != 0:
+                    output.append(f"(exit code: {result.returncode})")
+                else:
+                    # Newline to space out the commands.
+                    output.append("")
+                trace("\n".join(output))
 
             # Raise our own exception instead of using check=True because the
             # default exception doesn't have the stdout/stderr output.
             if result.returncode != 0:
-                trace(f"(exit code: {result.returncode})")
                 raise CommandFailure(result)
 
-            # Newline to space out the commands.
-            trace("")
-
             return result
 
+        # Cache the function so later lookups bypass __getattr__.
+        setattr(self, command, func)
         return func
 
     def _shellout(
@@ -122,23 +141,37 @@ class CliCmd:
         )
 
     def _inproc(self, command: str, args: List[str], env: Dict[str, str], stdin: bytes):
-        with override_environ(env):
-            old_cwd = os.getcwd()
-            os.chdir(self.cwd)
+        with _inproc_lock, override_environ(env):
+            # The cwd is not restored afterwards, so consecutive commands in
+            # the same directory skip the chdir. BaseTest restores it at the
+            # end of each test. Compare against the real cwd rather than
+            # remembering it, since a command may change it (e.g. --cwd).
             try:
-                args = ["hg", command] + args
-                fout = io.BytesIO()
-                ferr = io.BytesIO()
-                fin = io.BytesIO(stdin or b"")
-                returncode = bindings.commands.run(args, fin, fout, ferr)
-                return subprocess.CompletedProcess(
-                    args,
-                    returncode,
-                    stdout=fout.getvalue(),
-                    stderr=ferr.getvalue(),
-                )
-            finally:
-                os.chdir(old_cwd)
+                cwd = os.getcwd()
+            except FileNotFoundError:
+                cwd = None
+            if cwd != str(self.cwd):
+                os.chdir(self.cwd)
+
+            args = ["hg", command] + args
+            fout = self._fout
+            ferr = self._ferr
+            for f in (fout, ferr):
+                f.seek(0)
+                f.truncate()
+            fin = io.BytesIO(stdin or b"")
+            returncode = bindings.commands.run(args, fin, fout, ferr)
+            return subprocess.CompletedProcess(
+                args,
+                returncode,
+                stdout=fout.getvalue(),
+                stderr=ferr.getvalue(),
+            )
+
+
+def _option(key: str) -> str:
+    key = key.replace("_", "-")
+    return ("--" if len(key) != 1 else "-") + key
 
 
 class hg(CliCmd):
@@ -7,7 +7,7 @@
 from __future__ import annotations
 
 import json
-from typing import List
+from typing import List, Union
 
 
 class Status:
@@ -17,7 +17,7 @@ class Status:
     removed: List[str]
     untracked: List[str]
 
-    def __init__(self, raw_json: str) -> None:
+    def __init__(self, raw_json: Union[str, bytes]) -> None:
         self.added = []
         self.deleted = []
         self.modified = []
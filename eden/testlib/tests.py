@@ -11,6 +11,7 @@ from pathlib import Path
 from .base import BaseTest, hgtest
 from .repo import Repo
 from .types import PathLike
+from .util import new_dir
 from .workingcopy import WorkingCopy
 
 
@@ -116,6 +117,37 @@ class TestLibTests(BaseTest):
         wc.checkout(commit2)
         self.assertEqual(wc.current_commit(), commit2)
 
+    @hgtest
+    def test_commit_ancestor(self, repo: Repo, wc: WorkingCopy) -> None:
+        wc.file()
+        commit1 = wc.commit()
+        wc.file()
+        commit2 = wc.commit()
+        wc.file()
+        commit3 = wc.commit()
+
+        self.assertEqual(commit3.ancestor(0), commit3)
+        self.assertEqual(commit3.ancestor(1), commit2)
+        self.assertEqual(commit3.ancestor(2), commit1)
+        with self.assertRaises(ValueError):
+            commit3.ancestor(3)
+
+    @hgtest
+    def test_eden_working_copy_cleanup(self, repo: Repo, wc: WorkingCopy) -> None:
+        if not os.environ.get("USE_EDEN", False):
+            self.skipTest("requires EdenFS")
+
+        eden_wc = repo.new_working_copy(path=new_dir(), eden=True)
+        root = os.path.realpath(eden_wc.root)
+        # Leaves the process cwd inside the checkout.
+        eden_wc.status()
+        self.assertEqual(os.path.realpath(os.getcwd()), root)
+
+        # Unmounting must not be blocked by the process cwd.
+        eden_wc.cleanup()
+        cwd = os.path.realpath(os.getcwd())
+        self.assertNotEqual(os.path.commonpath([cwd, root]), root)
+
     @hgtest
     def test_drawdag(self, repo: Repo, wc: WorkingCopy) -> None:
         repo.drawdag(
@@ -144,4 +144,7 @@ overrides = {{}}
         super().__init__(repo, path)
 
     def cleanup(self) -> None:
+        # In-process hg commands leave the process cwd where they last ran,
+        # which may be inside this checkout. Step out so it can be unmounted.
+        os.chdir(os.path.dirname(self.root))
         self.eden.cleanup()